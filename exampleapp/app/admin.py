@@ -1,24 +1,49 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
-from django.http import HttpResponse, JsonResponse, HttpRequest
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.http import HttpResponse, JsonResponse, HttpRequest, Http404
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from privex.adminplus.admin import ct_register, register_url, CustomAdmin
 from app.models import Comment, Post
+from typing import Callable, List, Optional
+import hashlib
+import json
 import logging
 
 log = logging.getLogger(__name__)
 
 ctadmin: CustomAdmin = admin.site
 
+# Passed as ``json_dumps_params`` for the data views, to drop the whitespace json.dumps adds after separators
+COMPACT_JSON = dict(separators=(',', ':'))
+
+# How long (in seconds) the serialised user_info / post_info payloads are cached for. Saving or deleting the
+# relevant models clears them sooner, see the signal receivers at the bottom of this file.
+INFO_CACHE_TTL = 300
+
+# The maximum number of post IDs which can be requested at once from post_info_bulk
+POST_INFO_BULK_MAX = 100
+# The largest value a post ID can have - the maximum of a signed 64-bit integer, which is the largest primary key
+# the database backends can store. Bigger IDs would raise an OverflowError / DataError in the database driver.
+POST_ID_MAX = 2 ** 63 - 1
+
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ['title', 'user']
+    list_select_related = ('user',)
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ['title', 'user']
+    list_select_related = ('user',)
 
 
 @register_url(url='hello/')
@@ -52,35 +77,197 @@ class ClassViewTest(View):
         return HttpResponse(b"this is a class view")
 
 
+def _user_cache_key(username: str) -> str:
+    # Usernames come straight from the URL and may contain characters which memcached doesn't allow in keys
+    return 'user_info:' + hashlib.md5(username.encode('utf-8')).hexdigest()
+
+
+def _post_cache_keys(post_id: int) -> List[str]:
+    return [f'post_info:{post_id}:basic', f'post_info:{post_id}:comments']
+
+
+def _cached_payload(key: str, builder: Callable[..., Optional[str]], *args) -> Optional[HttpResponse]:
+    """
+    Return the JSON payload cached under ``key``, calling ``builder(*args)`` and caching the result if it isn't cached.
+    
+    If ``builder`` returns ``None`` (e.g. the object doesn't exist), nothing is cached, and ``None`` is returned.
+    """
+    payload = cache.get(key)
+    if payload is None:
+        payload = builder(*args)
+        if payload is None:
+            return None
+        cache.set(key, payload, INFO_CACHE_TTL)
+    return HttpResponse(payload, content_type='application/json')
+
+
+def _build_user_info(username: str) -> Optional[str]:
+    """Build the serialised JSON payload for :func:`.user_info`, or ``None`` if there's no user named ``username``"""
+    u = User.objects.filter(username=username).values('id', 'username', 'first_name', 'last_name').first()
+    return json.dumps(u, cls=DjangoJSONEncoder, **COMPACT_JSON) if u else None
+
+
 @register_url(['user_info/', 'user_info/<str:username>/'])
 def user_info(request, username=None):
     if username:
-        u = User.objects.filter(username=username).first()
-        return JsonResponse(dict(id=u.id, username=u.username, first_name=u.first_name, last_name=u.last_name))
-    return JsonResponse(dict(error=True, message="no username in URL"))
-
-
-@register_url({
-    'post_info/': 'post_info',
-    'post_info/<int:post_id>/': 'post_info_byid',
-    'post_info/<int:post_id>/comments': 'post_comments'
-})
-def post_info(request: HttpRequest, post_id=None):
-    get_comments = request.path.endswith('/comments')
+        res = _cached_payload(_user_cache_key(username), _build_user_info, username)
+        if res is None:
+            return JsonResponse(dict(error=True, message="user not found"), json_dumps_params=COMPACT_JSON)
+        return res
+    return JsonResponse(dict(error=True, message="no username in URL"), json_dumps_params=COMPACT_JSON)
+
+
+def _post_comments_json_pg(post_id: int) -> str:
+    """
+    Build the ``post_info`` comments payload with a single PostgreSQL query, letting the database nest the comments
+    using ``json_build_object`` / ``json_agg`` - returns the JSON as a string, ready to be sent as the response body.
+    
+    .. NOTE:: The JSON text is returned exactly as PostgreSQL produces it, which uses ``"key" : value`` separators.
+              The body therefore isn't formatted with :attr:`.COMPACT_JSON` like the other backends - the data itself
+              is identical to :func:`._post_comments_json_orm`, but the bytes differ.
+    """
+    qn = connection.ops.quote_name
+    post_meta, comment_meta, user_meta = Post._meta, Comment._meta, User._meta
     
-    if post_id:
-        p: Post = Post.objects.get(id=post_id)
-        post_dict = dict(id=p.id, title=p.title, content=p.content, user=p.user.username)
-        res = dict(post_dict)
-        if get_comments:
-            res = dict(post=post_dict, comments=[])
-            for c in p.comments.all():   # type: Comment
-                res['comments'].append(
-                    dict(id=c.id, title=c.title, content=c.content, user=c.user.username)
+    def col(meta, field: str) -> str:
+        return qn(meta.get_field(field).column)
+    
+    post_table, comment_table, user_table = qn(post_meta.db_table), qn(comment_meta.db_table), qn(user_meta.db_table)
+    post_pk, comment_pk, user_pk = qn(post_meta.pk.column), qn(comment_meta.pk.column), qn(user_meta.pk.column)
+    title, content, username = col(post_meta, 'title'), col(post_meta, 'content'), col(user_meta, 'username')
+    c_title, c_content = col(comment_meta, 'title'), col(comment_meta, 'content')
+    post_user, comment_user, comment_post = col(post_meta, 'user'), col(comment_meta, 'user'), col(comment_meta, 'post')
+    sql = f"""
+        SELECT json_build_object(
+            'post', json_build_object('id', p.{post_pk}, 'title', p.{title}, 'content', p.{content}, 'user', u.{username}),
+            'comments', COALESCE((
+                SELECT json_agg(
+                    json_build_object('id', c.{comment_pk}, 'title', c.{c_title}, 'content', c.{c_content}, 'user', cu.{username})
+                    ORDER BY c.{comment_pk}
                 )
-        return JsonResponse(res)
+                FROM {comment_table} c INNER JOIN {user_table} cu ON cu.{user_pk} = c.{comment_user}
+                WHERE c.{comment_post} = p.{post_pk}
+            ), '[]'::json)
+        )::text
+        FROM {post_table} p INNER JOIN {user_table} u ON u.{user_pk} = p.{post_user}
+        WHERE p.{post_pk} = %s
+    """
+    with connection.cursor() as cur:
+        cur.execute(sql, [post_id])
+        row = cur.fetchone()
+    if row is None:
+        raise Http404(f"No post with ID {post_id}")
+    return row[0]
+
+
+def _post_comments_json_orm(post_id: int) -> str:
+    """Build the ``post_info`` comments payload using the ORM, for database backends other than PostgreSQL"""
+    p: Post = Post.objects.select_related('user').only('id', 'title', 'content', 'user__username').filter(id=post_id).first()
+    if p is None:
+        raise Http404(f"No post with ID {post_id}")
+    # Project straight into dicts with .values() - the user__username lookup is done via a JOIN,
+    # and no Comment / User model instances are constructed per row.
+    comments = p.comments.order_by('id').values('id', 'title', 'content', 'user__username')
+    res = dict(
+        post=dict(id=p.id, title=p.title, content=p.content, user=p.user.username),
+        comments=[
+            dict(id=c['id'], title=c['title'], content=c['content'], user=c['user__username'])
+            for c in comments.iterator(chunk_size=500)
+        ]
+    )
+    return json.dumps(res, cls=DjangoJSONEncoder, **COMPACT_JSON)
+
+
+def _build_post_basic(post_id: int) -> str:
+    """Build the serialised JSON payload for :func:`.post_info_byid` - only the post's own fields, no comments"""
+    p = Post.objects.filter(id=post_id).values('id', 'title', 'content', 'user__username').first()
+    if p is None:
+        raise Http404(f"No post with ID {post_id}")
+    res = dict(id=p['id'], title=p['title'], content=p['content'], user=p['user__username'])
+    return json.dumps(res, cls=DjangoJSONEncoder, **COMPACT_JSON)
+
+
+def _build_post_with_comments(post_id: int) -> str:
+    """Build the serialised JSON payload for :func:`.post_comments` - the post, along with all of its comments"""
+    if connection.vendor == 'postgresql':
+        return _post_comments_json_pg(post_id)
+    return _post_comments_json_orm(post_id)
+
+
+@register_url({'post_info/': 'post_info'})
+def post_info(request: HttpRequest):
+    return JsonResponse(dict(error=True, message="no post id in URL"), json_dumps_params=COMPACT_JSON)
+
+
+@register_url({'post_info/<int:post_id>/': 'post_info_byid'})
+def post_info_byid(request: HttpRequest, post_id: int):
+    return _cached_payload(_post_cache_keys(post_id)[0], _build_post_basic, post_id)
+
+
+@register_url({'post_info/<int:post_id>/comments': 'post_comments'})
+def post_comments(request: HttpRequest, post_id: int):
+    return _cached_payload(_post_cache_keys(post_id)[1], _build_post_with_comments, post_id)
+
+
+@register_url({'post_info_bulk/': 'post_info_bulk'})
+@csrf_exempt
+def post_info_bulk(request: HttpRequest):
+    """
+    Return multiple posts along with their comments in one request, keyed by post ID.
+
+    Post IDs can be passed as repeated query parameters (``?id=1&id=2``), or as a JSON body
+    containing either a list of integer IDs, or an object with an ``ids`` list. At most
+    :attr:`.POST_INFO_BULK_MAX` IDs can be requested at once.
+    
+    The view is CSRF exempt so that the JSON body can be POSTed by API clients. This is safe because it's read-only,
+    and returns the same data to every caller - it never writes anything or checks the session, so a forged
+    cross-site POST can't do anything, and the browser won't let the forging site read the response.
+    """
+    ids = request.GET.getlist('id')
+    if ids:
+        if not all(i.isdecimal() for i in ids):
+            return JsonResponse(dict(error=True, message="post IDs must be integers"), status=400, json_dumps_params=COMPACT_JSON)
+        ids = [int(i) for i in ids]
+    elif request.body:
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            return JsonResponse(
+                dict(error=True, message="request body is not valid JSON"), status=400, json_dumps_params=COMPACT_JSON
+            )
+        ids = body.get('ids', []) if isinstance(body, dict) else body
+        # bool is a subclass of int, so it has to be excluded explicitly
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return JsonResponse(
+                dict(error=True, message="post IDs must be a list of integers"), status=400, json_dumps_params=COMPACT_JSON
+            )
+    if not ids:
+        return JsonResponse(dict(error=True, message="no post IDs specified"), status=400, json_dumps_params=COMPACT_JSON)
+    if not all(1 <= i <= POST_ID_MAX for i in ids):
+        return JsonResponse(
+            dict(error=True, message=f"post IDs must be between 1 and {POST_ID_MAX}"), status=400,
+            json_dumps_params=COMPACT_JSON
+        )
+    if len(ids) > POST_INFO_BULK_MAX:
+        return JsonResponse(
+            dict(error=True, message=f"too many post IDs specified (maximum {POST_INFO_BULK_MAX})"), status=400,
+            json_dumps_params=COMPACT_JSON
+        )
+    
+    # Two queries serve the whole batch - one for the posts (joined with their users), and one for all of their comments
+    comments_qs = Comment.objects.select_related('user').only('id', 'title', 'content', 'post_id', 'user__username')
+    posts = Post.objects.filter(id__in=ids).select_related('user').only('id', 'title', 'content', 'user__username') \
+        .prefetch_related(Prefetch('comments', queryset=comments_qs))
     
-    return JsonResponse(dict(error=True, message="no post id in URL"))
+    res = {}
+    for p in posts:   # type: Post
+        res[p.id] = dict(
+            post=dict(id=p.id, title=p.title, content=p.content, user=p.user.username),
+            comments=[
+                dict(id=c.id, title=c.title, content=c.content, user=c.user.username) for c in p.comments.all()
+            ]
+        )
+    return JsonResponse(res, json_dumps_params=COMPACT_JSON)
 
 
 def yet_another_test_view(request: HttpRequest):
@@ -102,3 +289,62 @@ class DecWrappedManual(View):
 
 
 DecWrappedManual = register_url('wrapped_manual_dec/', human='View manually wrapped with decorator')(DecWrappedManual)
+
+
+# The pre_save receivers below remember the username / post which is currently stored in the database, so that the
+# post_save receivers can also clear the cache entries for the old value when a user is renamed, or a comment is
+# moved to a different post.
+
+def _save_may_change(instance, field: str, update_fields=None) -> bool:
+    """
+    Returns ``True`` if saving ``instance`` with ``update_fields`` could change the stored value of ``field``.
+    
+    ``update_fields`` may refer to a field by either its name or its attname (e.g. ``post`` or ``post_id``),
+    so both are checked.
+    """
+    if instance.pk is None:
+        return False
+    if update_fields is None:
+        return True
+    f = instance._meta.get_field(field)
+    return f.name in update_fields or f.attname in update_fields
+
+
+@receiver(pre_save, sender=User)
+def _store_old_username(sender, instance: User, update_fields=None, **kwargs):
+    if not _save_may_change(instance, 'username', update_fields):
+        # Avoid a query for saves which can't change the username, e.g. updating last_login when logging in
+        return
+    instance._old_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(pre_save, sender=Comment)
+def _store_old_post_id(sender, instance: Comment, update_fields=None, **kwargs):
+    if not _save_may_change(instance, 'post', update_fields):
+        return
+    instance._old_post_id = Comment.objects.filter(pk=instance.pk).values_list('post_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=User)
+def _clear_user_info_cache(sender, instance: User, **kwargs):
+    old_username = instance.__dict__.pop('_old_username', None)
+    usernames = {instance.username, old_username} - {None}
+    keys = [_user_cache_key(u) for u in usernames]
+    if old_username is not None and old_username != instance.username:
+        # The username is embedded in the post_info payloads of the user's posts, and of the posts they commented on.
+        # Only renames pay for these queries - deleting a user cascades to their posts/comments, which clear themselves.
+        post_ids = set(Post.objects.filter(user=instance).values_list('id', flat=True))
+        post_ids |= set(Comment.objects.filter(user=instance).values_list('post_id', flat=True))
+        keys += [k for post_id in post_ids for k in _post_cache_keys(post_id)]
+    cache.delete_many(keys)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def _clear_post_info_cache(sender, instance: Post, **kwargs):
+    cache.delete_many(_post_cache_keys(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def _clear_post_comments_cache(sender, instance: Comment, **kwargs):
+    post_ids = {instance.post_id, instance.__dict__.pop('_old_post_id', None)} - {None}
+    cache.delete_many([k for post_id in post_ids for k in _post_cache_keys(post_id)])
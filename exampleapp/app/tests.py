@@ -0,0 +1,263 @@
+import json
+import warnings
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import CacheKeyWarning, cache
+from django.db import connection
+from django.template import Context, Engine
+from django.test import Client, SimpleTestCase, TestCase
+from django.urls import reverse
+from privex.adminplus.backports.templatetags import blocktranslate as bt
+from app.admin import POST_ID_MAX, POST_INFO_BULK_MAX, _post_comments_json_orm, _post_comments_json_pg
+from app.models import Comment, Post
+
+
+class TestPostInfoBulk(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='bob')
+        cls.post = Post.objects.create(user=cls.user, title='Hello', content='World')
+        cls.url = reverse('admin:post_info_bulk')
+    
+    def _post_json(self, body):
+        return self.client.post(self.url, data=json.dumps(body), content_type='application/json')
+    
+    def test_query_params(self):
+        res = self.client.get(self.url, {'id': [self.post.id]})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()[str(self.post.id)]['post']['title'], 'Hello')
+    
+    def test_json_list(self):
+        res = self._post_json([self.post.id])
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(str(self.post.id), res.json())
+    
+    def test_json_object(self):
+        res = self._post_json({'ids': [self.post.id]})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(str(self.post.id), res.json())
+    
+    def test_json_with_csrf_checks(self):
+        client = Client(enforce_csrf_checks=True)
+        res = client.post(self.url, data=json.dumps([self.post.id]), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(str(self.post.id), res.json())
+    
+    def test_rejects_non_integer_ids(self):
+        for body in ["11", {'ids': "1"}, [1.9], [True], ["1"]]:
+            with self.subTest(body=body):
+                self.assertEqual(self._post_json(body).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'id': ['1.9']}).status_code, 400)
+    
+    def test_rejects_out_of_range_ids(self):
+        for body in [[0], [-1], [POST_ID_MAX + 1], [10 ** 30]]:
+            with self.subTest(body=body):
+                self.assertEqual(self._post_json(body).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'id': ['9' * 30]}).status_code, 400)
+    
+    def test_rejects_no_ids(self):
+        self.assertEqual(self._post_json([]).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+    
+    def test_rejects_too_many_ids(self):
+        res = self._post_json(list(range(1, POST_INFO_BULK_MAX + 2)))
+        self.assertEqual(res.status_code, 400)
+
+
+class TestPostComments(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='bob')
+        cls.commenter = User.objects.create(username='alice')
+        cls.post = Post.objects.create(user=cls.user, title='Hello', content='World')
+        Comment.objects.create(user=cls.commenter, post=cls.post, title='First', content='Nice post')
+        Comment.objects.create(user=cls.user, post=cls.post, title='Second', content='Thanks')
+    
+    def test_post_comments(self):
+        res = self.client.get(reverse('admin:post_comments', args=[self.post.id]))
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn(b'": ', res.content)
+        data = res.json()
+        self.assertEqual(data['post']['user'], 'bob')
+        self.assertEqual([c['user'] for c in data['comments']], ['alice', 'bob'])
+    
+    @skipUnless(connection.vendor == 'postgresql', 'only applies to PostgreSQL')
+    def test_pg_matches_orm(self):
+        # PostgreSQL's own JSON separators are kept, so only the decoded data is compared
+        self.assertEqual(json.loads(_post_comments_json_pg(self.post.id)), json.loads(_post_comments_json_orm(self.post.id)))
+
+
+class TestInfoCacheInvalidation(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='bob')
+        cls.post = Post.objects.create(user=cls.user, title='Hello', content='World')
+        cls.other_post = Post.objects.create(user=cls.user, title='Other', content='Post')
+        cls.comment = Comment.objects.create(user=cls.user, post=cls.post, title='First', content='Nice post')
+    
+    def setUp(self):
+        cache.clear()
+    
+    def _user_info(self, username):
+        return self.client.get(reverse('admin:user_info_2', args=[username])).json()
+    
+    def _comment_titles(self, post):
+        res = self.client.get(reverse('admin:post_comments', args=[post.id])).json()
+        return [c['title'] for c in res['comments']]
+    
+    def test_user_rename_clears_old_username(self):
+        self.assertEqual(self._user_info('bob')['username'], 'bob')
+        user = User.objects.get(username='bob')
+        user.username = 'robert'
+        user.save()
+        self.assertTrue(self._user_info('bob')['error'])
+        self.assertEqual(self._user_info('robert')['username'], 'robert')
+    
+    def test_user_rename_clears_post_payloads(self):
+        commenter = User.objects.create(username='alice')
+        Comment.objects.create(user=commenter, post=self.other_post, title='Reply', content='Hi')
+        byid_url = reverse('admin:post_info_byid', args=[self.other_post.id])
+        comments_url = reverse('admin:post_comments', args=[self.other_post.id])
+        self.assertEqual(self.client.get(byid_url).json()['user'], 'bob')
+        self.assertEqual(self.client.get(comments_url).json()['comments'][0]['user'], 'alice')
+        
+        user = User.objects.get(username='bob')
+        user.username = 'robert'
+        user.save()
+        commenter.username = 'alicia'
+        commenter.save()
+        
+        self.assertEqual(self.client.get(byid_url).json()['user'], 'robert')
+        res = self.client.get(comments_url).json()
+        self.assertEqual(res['post']['user'], 'robert')
+        self.assertEqual(res['comments'][0]['user'], 'alicia')
+    
+    def test_user_delete_clears_cache(self):
+        self.assertEqual(self._user_info('bob')['username'], 'bob')
+        User.objects.get(username='bob').delete()
+        self.assertTrue(self._user_info('bob')['error'])
+    
+    def test_comment_move_clears_old_post(self):
+        self.assertEqual(self._comment_titles(self.post), ['First'])
+        self.assertEqual(self._comment_titles(self.other_post), [])
+        comment = Comment.objects.get(pk=self.comment.pk)
+        comment.post = self.other_post
+        comment.save()
+        self.assertEqual(self._comment_titles(self.post), [])
+        self.assertEqual(self._comment_titles(self.other_post), ['First'])
+    
+    def test_comment_move_by_attname_clears_old_post(self):
+        self.assertEqual(self._comment_titles(self.post), ['First'])
+        comment = Comment.objects.get(pk=self.comment.pk)
+        comment.post_id = self.other_post.id
+        comment.save(update_fields=['post_id'])
+        self.assertEqual(self._comment_titles(self.post), [])
+    
+    def test_username_cache_key_is_safe(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertTrue(self._user_info('a b\x01')['error'])
+
+
+class TestBlockTranslateTag(SimpleTestCase):
+    """
+    Render tests for the backported ``blocktranslate`` tag. The ``pgettext`` / ``npgettext`` patches prefix the
+    message with its context, to check that the message context is actually passed through.
+    """
+    def _render(self, source, engine=None, **ctx):
+        template = (engine or Engine()).from_string(source)
+        context = Context(ctx)
+        return template.nodelist[0], template.render(context), context
+    
+    def test_plain(self):
+        node, out, _ = self._render('{% blocktranslate %}Hello {{ name }}, 100% off{% endblocktranslate %}', name='Bob')
+        self.assertIs(type(node), bt._BlockTransPlain)
+        self.assertEqual(out, 'Hello Bob, 100% off')
+    
+    def test_plain_static(self):
+        node, out, _ = self._render('{% blocktranslate %}Static 50%{% endblocktranslate %}')
+        self.assertIs(type(node), bt._BlockTransPlain)
+        self.assertEqual(out, 'Static 50%')
+    
+    def test_with(self):
+        _, out, context = self._render('{% blocktranslate with n=name|upper %}Hi {{ n }}{% endblocktranslate %}', name='bob')
+        self.assertEqual(out, 'Hi BOB')
+        self.assertNotIn('n', context)
+    
+    def test_plural(self):
+        source = '{% blocktranslate count counter=items|length %}{{ counter }} item{% plural %}{{ counter }} items' \
+                 '{% endblocktranslate %}'
+        node, out, context = self._render(source, items=[1, 2])
+        self.assertIs(type(node), bt._BlockTransPlural)
+        self.assertEqual(out, '2 items')
+        self.assertNotIn('counter', context)
+        self.assertEqual(self._render(source, items=[1])[1], '1 item')
+    
+    def test_context(self):
+        source = '{% blocktranslate context "greeting" with n=name %}Hi {{ n }}{% endblocktranslate %}'
+        with mock.patch('django.utils.translation.pgettext', side_effect=lambda c, m: f'{c}:{m}'):
+            node, out, _ = self._render(source, name='Bob')
+        self.assertIs(type(node), bt._BlockTransContext)
+        self.assertEqual(out, 'greeting:Hi Bob')
+    
+    def test_context_filtered(self):
+        source = '{% blocktranslate context ctx|lower %}Hi{% endblocktranslate %}'
+        with mock.patch('django.utils.translation.pgettext', side_effect=lambda c, m: f'{c}:{m}'):
+            node, out, _ = self._render(source, ctx='GREETING')
+        self.assertIs(type(node), bt._BlockTransContext)
+        self.assertEqual(out, 'greeting:Hi')
+    
+    def test_context_plural(self):
+        source = '{% blocktranslate context "shop" count counter=n %}{{ counter }} apple{% plural %}{{ counter }} apples' \
+                 '{% endblocktranslate %}'
+        def fake_npgettext(ctx, singular, plural, count):
+            return f'{ctx}:' + (singular if count == 1 else plural)
+        
+        with mock.patch('django.utils.translation.npgettext', side_effect=fake_npgettext):
+            node, out, context = self._render(source, n=3)
+        self.assertIs(type(node), bt._BlockTransContextPlural)
+        self.assertEqual(out, 'shop:3 apples')
+        self.assertNotIn('counter', context)
+    
+    def test_asvar_and_trimmed(self):
+        source = '{% blocktranslate trimmed asvar msg %}\n  Hello\n  world\n{% endblocktranslate %}[{{ msg }}]'
+        self.assertEqual(Engine().from_string(source).render(Context()), '[Hello world]')
+    
+    def test_string_if_invalid(self):
+        engine = Engine(string_if_invalid='INVALID(%s)')
+        _, out, _ = self._render('{% blocktranslate %}Hi {{ missing }}{% endblocktranslate %}', engine=engine)
+        self.assertEqual(out, 'Hi INVALID(missing)')
+
+
+class TestTranslateTag(SimpleTestCase):
+    def _render(self, source, **ctx):
+        template = Engine().from_string(source)
+        return template.nodelist[0], template.render(Context(ctx))
+    
+    def test_plain(self):
+        node, out = self._render('{% translate "Hello 100%" %}')
+        self.assertIs(type(node), bt._TranslateNodeNoContext)
+        self.assertEqual(out, 'Hello 100%')
+    
+    def test_noop(self):
+        node, out = self._render('{% translate "Hello" noop %}')
+        self.assertIs(type(node), bt._TranslateNodeNoContext)
+        self.assertFalse(node.filter_expression.var.translate)
+        self.assertEqual(out, 'Hello')
+    
+    def test_noop_with_context(self):
+        node, out = self._render('{% translate "Hello" noop context "greeting" %}')
+        self.assertIs(type(node), bt._TranslateNodeNoContext)
+        self.assertEqual(out, 'Hello')
+    
+    def test_context(self):
+        node, out = self._render('{% translate "Hello" context ctx %}', ctx='greeting')
+        self.assertIs(type(node), bt.TranslateNode)
+        self.assertEqual(node.filter_expression.var.message_context, 'greeting')
+        self.assertEqual(out, 'Hello')
+    
+    def test_asvar(self):
+        self.assertEqual(Engine().from_string('{% translate "Hi" as msg %}[{{ msg }}]').render(Context()), '[Hi]')
+    
+    def test_context_filter_cache(self):
+        self.assertIs(bt.compile_context_filter(None, '"greeting"'), bt.compile_context_filter(None, '"greeting"'))
@@ -38,13 +38,37 @@ Django Project Copyright::
 
 """
 # noinspection PyProtectedMember
+from collections import deque
+from functools import lru_cache
 from django.template import Node, TemplateSyntaxError
-from django.template.base import TokenType, Variable, render_value_in_context, token_kwargs
+from django.template.base import FilterExpression, TokenType, Variable, render_value_in_context, token_kwargs
 from django.template.defaulttags import register
 from django.utils import translation
 from django.utils.safestring import SafeData, mark_safe
 
 
+@lru_cache(maxsize=4096)
+def _compile_unfiltered(expr: str) -> FilterExpression:
+    # Without any filters, the parser is never used, so the result only depends on ``expr``
+    return FilterExpression(expr, None)
+
+
+def compile_context_filter(parser, expr: str) -> FilterExpression:
+    """
+    Compile the ``context`` option of a ``translate`` / ``blocktranslate`` tag, re-using a cached
+    :class:`.FilterExpression` when ``expr`` has no filters (e.g. ``context "greeting"``).
+    
+    Expressions containing filters are always compiled with ``parser``, as the filters available depend on the
+    libraries which the template has loaded.
+    
+    .. NOTE:: Only use this for expressions which are resolved as-is - cached instances are shared across every
+              template, so they must never be mutated (unlike the message expression of :class:`.TranslateNode`)
+    """
+    if '|' in expr:
+        return parser.compile_filter(expr)
+    return _compile_unfiltered(expr)
+
+
 class TranslateNode(Node):
     def __init__(self, filter_expression, noop, asvar=None,
                  message_context=None):
@@ -54,19 +78,24 @@ class TranslateNode(Node):
         self.filter_expression = filter_expression
         if isinstance(self.filter_expression.var, str):
             self.filter_expression.var = Variable("'%s'" % self.filter_expression.var)
+        # The filter expression belongs to this node alone, and ``noop`` can't change after parsing, so the
+        # translate flag only needs to be set once - rather than on every render.
+        self.filter_expression.var.translate = not self.noop
     
     def render(self, context):
-        self.filter_expression.var.translate = not self.noop
         if self.message_context:
             self.filter_expression.var.message_context = (
                 self.message_context.resolve(context))
         output = self.filter_expression.resolve(context)
-        value = render_value_in_context(output, context)
+        return self._finish(render_value_in_context(output, context), context)
+    
+    def _finish(self, value, context):
         # Restore percent signs. Percent signs in template text are doubled
         # so they are not interpreted as string format flags.
-        is_safe = isinstance(value, SafeData)
-        value = value.replace('%%', '%')
-        value = mark_safe(value) if is_safe else value
+        if '%' in value:
+            is_safe = isinstance(value, SafeData)
+            value = value.replace('%%', '%')
+            value = mark_safe(value) if is_safe else value
         if self.asvar:
             context[self.asvar] = value
             return ''
@@ -74,6 +103,16 @@ class TranslateNode(Node):
             return value
 
 
+class _TranslateNodeNoContext(TranslateNode):
+    """
+    :class:`.TranslateNode` used when there's no ``context`` option to resolve - or when ``noop`` is set,
+    as the message context is never used for untranslated values.
+    """
+    def render(self, context):
+        output = self.filter_expression.resolve(context)
+        return self._finish(render_value_in_context(output, context), context)
+
+
 class BlockTranslateNode(Node):
     
     def __init__(self, extra_context, singular, plural=None, countervar=None,
@@ -88,13 +127,27 @@ class BlockTranslateNode(Node):
         self.trimmed = trimmed
         self.asvar = asvar
         self.tag_name = tag_name
+        # The token lists can't change after parsing, so the message strings and their variable names
+        # are built once here, instead of on every render.
+        self._singular_msg, self._singular_vars = self._build_message(self.singular)
+        self._plural_msg, self._plural_vars = self._build_message(self.plural) if self.plural else ('', ())
+        self._extra_items = tuple(self.extra_context.items())
+        self._is_plural = bool(self.plural and self.countervar and self.counter)
+        self._vars = self._singular_vars + self._plural_vars if self._is_plural else self._singular_vars
+        # The counter variable is written into the pushed context, so a push is also needed for "count"
+        self._push_context = bool(self._extra_items) or self._is_plural
+    
+    def _build_message(self, tokens):
+        msg, vars = self.render_token_list(tokens)
+        return msg, tuple(vars)
     
     def render_token_list(self, tokens):
         result = []
         vars = []
         for token in tokens:
             if token.token_type == TokenType.TEXT:
-                result.append(token.contents.replace('%', '%%'))
+                contents = token.contents
+                result.append(contents.replace('%', '%%') if '%' in contents else contents)
             elif token.token_type == TokenType.VAR:
                 result.append('%%(%s)s' % token.contents)
                 vars.append(token.contents)
@@ -108,36 +161,43 @@ class BlockTranslateNode(Node):
             message_context = self.message_context.resolve(context)
         else:
             message_context = None
-        # Update() works like a push(), so corresponding context.pop() is at
-        # the end of function
-        context.update({var: val.resolve(context) for var, val in self.extra_context.items()})
-        singular, vars = self.render_token_list(self.singular)
-        if self.plural and self.countervar and self.counter:
+        return self._render(context, message_context, nested)
+    
+    def _translate(self, context, message_context):
+        """Translate the message, picking the appropriate gettext function for the tag's options"""
+        singular = self._singular_msg
+        if self._is_plural:
             count = self.counter.resolve(context)
             context[self.countervar] = count
-            plural, plural_vars = self.render_token_list(self.plural)
             if message_context:
-                result = translation.npgettext(message_context, singular,
-                                               plural, count)
-            else:
-                result = translation.ngettext(singular, plural, count)
-            vars.extend(plural_vars)
-        else:
-            if message_context:
-                result = translation.pgettext(message_context, singular)
-            else:
-                result = translation.gettext(singular)
-        default_value = context.template.engine.string_if_invalid
-        
-        def render_value(key):
-            if key in context:
-                val = context[key]
-            else:
-                val = default_value % key if '%s' in default_value else default_value
-            return render_value_in_context(val, context)
-        
-        data = {v: render_value(v) for v in vars}
-        context.pop()
+                return translation.npgettext(message_context, singular, self._plural_msg, count)
+            return translation.ngettext(singular, self._plural_msg, count)
+        if message_context:
+            return translation.pgettext(message_context, singular)
+        return translation.gettext(singular)
+    
+    def _render(self, context, message_context, nested):
+        # Update() works like a push(), so corresponding context.pop() is
+        # further down
+        if self._push_context:
+            context.update({var: val.resolve(context) for var, val in self._extra_items})
+        result = self._translate(context, message_context)
+        data = {}
+        if self._vars:
+            default_value = context.template.engine.string_if_invalid
+            has_fmt = '%s' in default_value
+            for v in self._vars:
+                # A single lookup instead of ``key in context`` followed by ``context[key]``
+                try:
+                    val = context[v]
+                except KeyError:
+                    val = default_value % v if has_fmt else default_value
+                data[v] = render_value_in_context(val, context)
+        if self._push_context:
+            context.pop()
+        # Without any placeholders, formatting is only needed to restore doubled percent signs
+        if not data and '%' not in result:
+            return self._finish(result, context)
         try:
             result = result % data
         except (KeyError, ValueError):
@@ -149,6 +209,9 @@ class BlockTranslateNode(Node):
                 )
             with translation.override(None):
                 result = self.render(context, nested=True)
+        return self._finish(result, context)
+    
+    def _finish(self, result, context):
         if self.asvar:
             context[self.asvar] = result
             return ''
@@ -156,6 +219,43 @@ class BlockTranslateNode(Node):
             return result
 
 
+# The below subclasses of BlockTranslateNode are picked by do_block_translate at parse time, based on whether
+# the tag has a "context" and/or "count" option - so that their render paths don't have to re-check those options.
+
+class _BlockTransPlain(BlockTranslateNode):
+    def render(self, context, nested=False):
+        return self._render(context, None, nested)
+    
+    def _translate(self, context, message_context):
+        return translation.gettext(self._singular_msg)
+
+
+class _BlockTransPlural(_BlockTransPlain):
+    def _translate(self, context, message_context):
+        count = self.counter.resolve(context)
+        context[self.countervar] = count
+        return translation.ngettext(self._singular_msg, self._plural_msg, count)
+
+
+class _BlockTransContext(BlockTranslateNode):
+    def render(self, context, nested=False):
+        return self._render(context, self.message_context.resolve(context), nested)
+    
+    def _translate(self, context, message_context):
+        if message_context:
+            return translation.pgettext(message_context, self._singular_msg)
+        return translation.gettext(self._singular_msg)
+
+
+class _BlockTransContextPlural(_BlockTransContext):
+    def _translate(self, context, message_context):
+        count = self.counter.resolve(context)
+        context[self.countervar] = count
+        if message_context:
+            return translation.npgettext(message_context, self._singular_msg, self._plural_msg, count)
+        return translation.ngettext(self._singular_msg, self._plural_msg, count)
+
+
 class LanguageNode(Node):
     def __init__(self, nodelist, language):
         self.nodelist = nodelist
@@ -213,7 +313,7 @@ def do_translate(parser, token):
     if len(bits) < 2:
         raise TemplateSyntaxError("'%s' takes at least one argument" % bits[0])
     message_string = parser.compile_filter(bits[1])
-    remaining = bits[2:]
+    remaining = deque(bits[2:])
     
     noop = False
     asvar = None
@@ -222,7 +322,7 @@ def do_translate(parser, token):
     invalid_context = {'as', 'noop'}
     
     while remaining:
-        option = remaining.pop(0)
+        option = remaining.popleft()
         if option in seen:
             raise TemplateSyntaxError(
                 "The '%s' option was specified more than once." % option,
@@ -231,7 +331,7 @@ def do_translate(parser, token):
             noop = True
         elif option == 'context':
             try:
-                value = remaining.pop(0)
+                value = remaining.popleft()
             except IndexError:
                 raise TemplateSyntaxError(
                     "No argument provided to the '%s' tag for the context option." % bits[0]
@@ -240,10 +340,10 @@ def do_translate(parser, token):
                 raise TemplateSyntaxError(
                     "Invalid argument '%s' provided to the '%s' tag for the context option" % (value, bits[0]),
                 )
-            message_context = parser.compile_filter(value)
+            message_context = compile_context_filter(parser, value)
         elif option == 'as':
             try:
-                value = remaining.pop(0)
+                value = remaining.popleft()
             except IndexError:
                 raise TemplateSyntaxError(
                     "No argument provided to the '%s' tag for the as option." % bits[0]
@@ -258,7 +358,9 @@ def do_translate(parser, token):
             )
         seen.add(option)
     
-    return TranslateNode(message_string, noop, asvar, message_context)
+    # Pick a specialised node at parse time, so the render path doesn't need to re-check options which can't change
+    node_cls = _TranslateNodeNoContext if noop or message_context is None else TranslateNode
+    return node_cls(message_string, noop, asvar, message_context)
 
 
 @register.tag("blocktranslate")
@@ -307,6 +409,7 @@ def do_block_translate(parser, token):
     bits = token.split_contents()
     
     options = {}
+    # This stays a list rather than a deque, as token_kwargs consumes the bits it parses using slice deletion
     remaining_bits = bits[1:]
     asvar = None
     while remaining_bits:
@@ -327,7 +430,7 @@ def do_block_translate(parser, token):
         elif option == "context":
             try:
                 value = remaining_bits.pop(0)
-                value = parser.compile_filter(value)
+                value = compile_context_filter(parser, value)
             except Exception:
                 raise TemplateSyntaxError(
                     '"context" in %r tag expected exactly one argument.' % bits[0]
@@ -380,7 +483,13 @@ def do_block_translate(parser, token):
     if token.contents.strip() != end_tag_name:
         raise TemplateSyntaxError("%r doesn't allow other block tags (seen %r) inside it" % (bits[0], token.contents))
     
-    return BlockTranslateNode(extra_context, singular, plural, countervar,
-                              counter, message_context, trimmed=trimmed,
-                              asvar=asvar, tag_name=bits[0])
+    is_plural = bool(plural and countervar and counter)
+    if message_context is None:
+        node_cls = _BlockTransPlural if is_plural else _BlockTransPlain
+    else:
+        node_cls = _BlockTransContextPlural if is_plural else _BlockTransContext
+    
+    return node_cls(extra_context, singular, plural, countervar,
+                    counter, message_context, trimmed=trimmed,
+                    asvar=asvar, tag_name=bits[0])
 